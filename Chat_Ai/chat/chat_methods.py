@@ -1,14 +1,16 @@
 # chat/chat_methods.py
+import io
 import os
 import re
 import uuid
-import json
+import mmap
 import asyncio
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from typing import AsyncGenerator, List, Optional, Tuple
+from typing import AsyncGenerator, Dict, List, Optional, Tuple
 
 import dotenv
+import orjson
 dotenv.load_dotenv()
 
 # ===== Paths =====
@@ -20,8 +22,8 @@ GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 USE_GROQ = bool(GROQ_API_KEY)
 if USE_GROQ:
     try:
-        from groq import Groq
-        groq_client = Groq(api_key=GROQ_API_KEY)
+        from groq import AsyncGroq
+        groq_client = AsyncGroq(api_key=GROQ_API_KEY)
     except Exception:  # library missing at dev time
         USE_GROQ = False
         groq_client = None
@@ -37,10 +39,10 @@ GROQ_MODELS = [
 
 TZ = timezone(timedelta(hours=3), name="AST")
 
-NAME_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+NAME_RE = re.compile(r"[A-Za-z0-9_-]{1,64}")
 
 def _slug_or_none(name: str) -> Optional[str]:
-    return name if NAME_RE.match(name or "") else None
+    return name if isinstance(name, str) and NAME_RE.fullmatch(name) else None
 
 # ===== JSONL helpers =====
 
@@ -48,8 +50,337 @@ def _chat_path(name: str) -> Path:
     return DATA_DIR / f"{name}.jsonl"
 
 def _append_jsonl(path: Path, obj: dict) -> None:
-    with path.open("a", encoding="utf-8") as f:
-        f.write(json.dumps(obj, ensure_ascii=False) + "\n")
+    _append_many(path, [obj])
+
+def _encode_records(objs: List[dict]) -> bytes:
+    return b"".join(orjson.dumps(obj) + b"\n" for obj in objs)
+
+def _append_many(path: Path, objs: List[dict]) -> int:
+    data = _encode_records(objs)
+    with path.open("ab") as f:
+        f.write(data)
+    return len(data)
+
+# Messages sent back as context on each turn (system prompt and summary not counted).
+# Every record holds at least one message, so reading this many records is enough.
+MAX_HISTORY_MESSAGES = max(0, int(os.getenv("MAX_HISTORY", "20")))
+ROLES = ("user", "assistant", "system")
+SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+
+def _last(items: List[dict], n: int) -> List[dict]:
+    # items[-n:] returns everything for n == 0; this returns nothing
+    return items[max(len(items) - n, 0):]
+
+def _is_summary(obj: dict) -> bool:
+    return obj.get("type") == "summary"
+
+def _chat_id(obj: dict) -> Optional[str]:
+    chats = obj.get("chats")
+    return chats.get("chat_id") if isinstance(chats, dict) else None
+
+def _split_summary(records: List[dict]) -> Tuple[Optional[dict], List[dict]]:
+    # The latest summary covers every turn up to and including its "covers" chat_id.
+    # Turns written after that one stay, even if they landed before the summary record.
+    for i in range(len(records) - 1, -1, -1):
+        if not _is_summary(records[i]):
+            continue
+        summary = records[i]
+        before = records[:i]
+        covers = summary.get("covers")
+        for j in range(len(before) - 1, -1, -1):
+            if covers is not None and _chat_id(before[j]) == covers:
+                before = before[j + 1:]
+                break
+        else:
+            # Covered turn outside the window: everything we hold is newer. No marker: covers all.
+            if covers is None:
+                before = []
+        return summary, [obj for obj in before if not _is_summary(obj)] + records[i + 1:]
+    return None, records
+
+def _trim_records(records: List[dict]) -> List[dict]:
+    # Keep the latest summary plus the turns it does not cover
+    summary, rest = _split_summary(records)
+    rest = _last(rest, MAX_HISTORY_MESSAGES)
+    return [summary] + rest if summary else rest
+
+def _history_messages(records: List[dict]) -> List[dict]:
+    summary, rest = _split_summary(records)
+    messages = [m for obj in rest for m in _record_messages(obj)]
+    head = [{"role": "system", "content": SUMMARY_PREFIX + summary["content"]}] if summary else []
+    return head + _last(messages, MAX_HISTORY_MESSAGES)
+
+def _turns_since_summary(records: List[dict]) -> int:
+    _, rest = _split_summary(records)
+    return sum(1 for obj in rest if "chats" in obj)
+
+def _record_messages(obj: dict) -> List[dict]:
+    if obj.get("type") == "meta":
+        return []
+    if obj.get("role") in ROLES:
+        return [{"role": obj["role"], "content": obj["content"]}]
+    chats = obj.get("chats")
+    if isinstance(chats, dict):
+        return [
+            {"role": m["role"], "content": m["content"]}
+            for m in chats.get("messages", [])
+            if m.get("role") in ROLES
+        ]
+    return []
+
+# Bytes at the end of the file to prefetch before the backward tail scan
+TAIL_PREFETCH = 256 * 1024
+
+def _advise_tail(mm: mmap.mmap) -> None:
+    # Only on platforms with madvise(2); the offset must be page aligned
+    if not hasattr(mmap, "MADV_WILLNEED"):
+        return
+    size = mm.size()
+    start = max(0, size - TAIL_PREFETCH) // mmap.PAGESIZE * mmap.PAGESIZE
+    try:
+        mm.madvise(mmap.MADV_WILLNEED, start, size - start)
+    except OSError:
+        pass
+
+def _tail_records(path: Path, limit: int) -> List[dict]:
+    # Walk the file backwards through an mmap so only the last `limit` lines are decoded.
+    # The walk ends at the turn the latest summary covers: nothing older is needed.
+    records: List[dict] = []
+    summary_seen = False
+    stop_id: Optional[str] = None
+    with path.open("rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return records
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            _advise_tail(mm)
+            end = mm.size()
+            if mm[end - 1] == ord("\n"):
+                end -= 1
+            while end > 0 and len(records) < limit:
+                nl = mm.rfind(b"\n", 0, end)
+                line = mm[nl + 1:end]
+                end = nl
+                if not line.strip():
+                    continue
+                try:
+                    obj = orjson.loads(line)
+                except ValueError:
+                    continue
+                if stop_id is not None and _chat_id(obj) == stop_id:
+                    break
+                records.append(obj)
+                if _is_summary(obj) and not summary_seen:
+                    summary_seen = True
+                    stop_id = obj.get("covers")
+                    if stop_id is None:
+                        break
+        finally:
+            mm.close()
+    records.reverse()
+    return records
+
+def _parse_lines(data: bytes) -> List[dict]:
+    records: List[dict] = []
+    for line in data.splitlines():
+        if not line.strip():
+            continue
+        try:
+            records.append(orjson.loads(line))
+        except ValueError:
+            continue
+    return records
+
+# ===== History cache (slug -> (mtime_ns, size, last records)) =====
+# Chat files only grow by append, so a changed size means "parse from the old offset".
+_history_cache: Dict[str, Tuple[int, int, List[dict]]] = {}
+
+def _load_records(slug: str, path: Path) -> List[dict]:
+    st = path.stat()
+    prev = _history_cache.get(slug)
+    if prev and prev[0] == st.st_mtime_ns and prev[1] == st.st_size:
+        return prev[2]
+    if prev and st.st_size > prev[1]:
+        with path.open("rb") as f:
+            f.seek(prev[1])
+            data = f.read()
+        # Leave a trailing partial line for the next call
+        cut = data.rfind(b"\n") + 1
+        records = _trim_records(prev[2] + _parse_lines(data[:cut]))
+        size = prev[1] + cut
+    else:
+        # One extra record so a summary just before the tail is still found
+        records = _tail_records(path, MAX_HISTORY_MESSAGES + 1)
+        size = st.st_size
+    _history_cache[slug] = (st.st_mtime_ns, size, records)
+    return records
+
+def _extend_history_cache(slug: str, st: os.stat_result, written: int, records: List[dict]) -> None:
+    # Our own append: extend the cached tail in place instead of re-reading it
+    prev = _history_cache.get(slug)
+    if prev and prev[1] + written == st.st_size:
+        _history_cache[slug] = (st.st_mtime_ns, st.st_size, _trim_records(prev[2] + records))
+    else:
+        _history_cache.pop(slug, None)
+
+# ===== Batched writer (one background task per chat) =====
+# Records queued within WRITE_BATCH_WINDOW seconds are flushed with a single write.
+WRITE_BATCH_MAX = 64
+WRITE_BATCH_WINDOW = 0.02
+APPEND_BUFFER_SIZE = 64 * 1024
+# A writer with nothing to do for this long closes its file and exits
+WRITER_IDLE_SECONDS = float(os.getenv("WRITER_IDLE_SECONDS", "60"))
+
+_write_queues: Dict[str, asyncio.Queue] = {}
+_write_tasks: Dict[str, asyncio.Task] = {}
+_appenders: Dict[str, io.BufferedWriter] = {}
+_locks: Dict[str, asyncio.Lock] = {}
+
+def _chat_lock(slug: str) -> asyncio.Lock:
+    # Held while a batch is written and while history is read, never for a whole turn
+    return _locks.setdefault(slug, asyncio.Lock())
+
+def _same_file(f: io.BufferedWriter, path: Path) -> bool:
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return False
+    fst = os.fstat(f.fileno())
+    return (fst.st_ino, fst.st_dev) == (st.st_ino, st.st_dev)
+
+def _appender(slug: str) -> io.BufferedWriter:
+    # Long-lived append handle per chat, opened on first write.
+    # Reopened if the file was deleted or replaced since, so writes never land in an unlinked inode.
+    path = _chat_path(slug)
+    f = _appenders.get(slug)
+    if f is not None and not f.closed and not _same_file(f, path):
+        _close_appender(slug)
+        f = None
+    if f is None or f.closed:
+        f = _appenders[slug] = open(path, "ab", buffering=APPEND_BUFFER_SIZE)
+    return f
+
+def _close_appender(slug: str) -> None:
+    f = _appenders.pop(slug, None)
+    if f is not None:
+        f.close()
+
+def _write_batch(f: io.BufferedWriter, data: bytes) -> None:
+    f.write(data)
+    f.flush()
+
+def _retire_writer(slug: str, queue: asyncio.Queue) -> None:
+    # Idle chat: release its fd, queue, task and lock; the next enqueue starts a fresh writer
+    _close_appender(slug)
+    if _write_queues.get(slug) is queue:
+        del _write_queues[slug]
+    if _write_tasks.get(slug) is asyncio.current_task():
+        del _write_tasks[slug]
+    lock = _locks.get(slug)
+    if lock is not None and not lock.locked():
+        del _locks[slug]
+
+async def _writer_loop(slug: str, queue: asyncio.Queue) -> None:
+    path = _chat_path(slug)
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            first = await asyncio.wait_for(queue.get(), WRITER_IDLE_SECONDS)
+        except asyncio.TimeoutError:
+            if queue.empty():
+                _retire_writer(slug, queue)
+                return
+            continue
+        batch = [first]
+        deadline = loop.time() + WRITE_BATCH_WINDOW
+        while len(batch) < WRITE_BATCH_MAX:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        try:
+            data = _encode_records(batch)
+            # Disk write runs in a worker thread; the lock keeps readers off half-written lines
+            async with _chat_lock(slug):
+                await asyncio.to_thread(_write_batch, _appender(slug), data)
+                st = path.stat()
+                _chat_index[slug] = st.st_mtime
+                _extend_history_cache(slug, st, len(data), batch)
+        except (OSError, ValueError) as e:
+            _close_appender(slug)
+            print(f"[writer] failed to write {len(batch)} record(s) to {path}: {e}")
+        finally:
+            for _ in batch:
+                queue.task_done()
+
+async def writer_enqueue(slug: str, record: dict) -> None:
+    queue = _write_queues.get(slug)
+    if queue is None:
+        queue = _write_queues[slug] = asyncio.Queue()
+    task = _write_tasks.get(slug)
+    if task is None or task.done():
+        _write_tasks[slug] = asyncio.create_task(_writer_loop(slug, queue))
+    await queue.put(record)
+
+async def writer_flush(slug: str) -> None:
+    # Wait until everything queued for this chat is on disk
+    queue = _write_queues.get(slug)
+    if queue is not None:
+        await queue.join()
+
+async def close_writers() -> None:
+    # Summaries still in flight enqueue a record when done, so let them finish first
+    if _summary_tasks:
+        await asyncio.gather(*_summary_tasks.values(), return_exceptions=True)
+    for slug in list(_write_queues):
+        await writer_flush(slug)
+    for task in _write_tasks.values():
+        task.cancel()
+    for slug in list(_appenders):
+        _close_appender(slug)
+    _write_tasks.clear()
+    _write_queues.clear()
+
+# ===== Chat index (slug -> mtime) =====
+# Kept in memory so listing chats does not walk DATA_DIR on every request.
+INDEX_REFRESH_SECONDS = float(os.getenv("INDEX_REFRESH_SECONDS", "30"))
+
+_chat_index: Dict[str, float] = {}
+
+def _scan_chats() -> Dict[str, float]:
+    index: Dict[str, float] = {}
+    with os.scandir(DATA_DIR) as it:
+        for entry in it:
+            if not (entry.is_file(follow_symlinks=False) and entry.name.endswith(".jsonl")):
+                continue
+            slug = _slug_or_none(entry.name[:-6])
+            if slug:
+                index[slug] = entry.stat(follow_symlinks=False).st_mtime
+    return index
+
+def refresh_chat_index() -> None:
+    # Pick up chats added, changed or removed outside this process
+    scanned = _scan_chats()
+    for slug in list(_chat_index):
+        if slug not in scanned:
+            del _chat_index[slug]
+            _close_appender(slug)
+    for slug, mtime in scanned.items():
+        if _chat_index.get(slug) != mtime:
+            _chat_index[slug] = mtime
+
+async def chat_index_refresher() -> None:
+    while True:
+        await asyncio.sleep(INDEX_REFRESH_SECONDS)
+        try:
+            refresh_chat_index()
+        except OSError as e:
+            print(f"[index] rescan of {DATA_DIR} failed: {e}")
+
+refresh_chat_index()
 
 # ===== Public API used by FastAPI layer =====
 
@@ -63,8 +394,7 @@ def create_chat(name: str, model: Optional[str] = None) -> Tuple[bool, dict]:
     path = _chat_path(slug)
     if path.exists():
         return False, {"message": "Chat already exists"}
-    riyadh_tz = timezone(timedelta(hours=3))
-    dt_riyadh = datetime.now(riyadh_tz).strftime("%Y-%m-%d %H:%M:%S")
+    dt_riyadh = datetime.now(TZ).isoformat(timespec="seconds")
     info = {
         "info":{
         "id": uuid.uuid4().hex[:6],
@@ -73,45 +403,86 @@ def create_chat(name: str, model: Optional[str] = None) -> Tuple[bool, dict]:
         }
     }
     _append_jsonl(path, info)
+    _chat_index[slug] = path.stat().st_mtime
     return True, {"id": info["info"]["id"], "name": slug, "created_at": info["info"]["created_at"]}
 
 
-def provide_chat(name: str) -> Optional[str]:
+def chat_file(name: str) -> Optional[Path]:
     slug = _slug_or_none(name)
     if not slug:
         return None
     path = _chat_path(slug)
     if not path.exists():
         return None
-    print(path.read_text(encoding="utf-8"))
-    return path.read_text(encoding="utf-8")
+    return path
+
 
-def history_chat():
-    list_chat = []
-    for file in os.listdir("./data"):
-        list_chat.append(file.split(".")[0])
-    return list_chat
+def history_chat() -> List[str]:
+    return list(_chat_index)
 
 # ===== Core chat (non-stream + stream) =====
 async def _stream_from_provider(messages: List[dict], model: str, temperature: float = 0.2) -> AsyncGenerator[str, None]:
     if USE_GROQ and groq_client:
         # Groq compatible streaming
-        stream = groq_client.chat.completions.create(
+        stream = await groq_client.chat.completions.create(
             model=model,
             messages=messages,
             temperature=temperature,
             stream=True,
         )
-        for chunk in stream:
+        async for chunk in stream:
             delta = getattr(chunk.choices[0].delta, "content", None)
             if delta:
                 yield delta
         return
     # Fallback dev streamer
     text = "(local dev) You said: " + next((m["content"] for m in reversed(messages) if m["role"] == "user"), "")
-    for ch in text:
-        yield ch
-        await asyncio.sleep(0.01)
+    # Word-sized chunks, not characters: one event-loop switch per word
+    words = text.split(" ")
+    for i, word in enumerate(words):
+        yield word if i == len(words) - 1 else word + " "
+        await asyncio.sleep(0.02)
+
+# ===== Rolling summary =====
+# Groq's chat API keeps no conversation state, so every N turns the recent history
+# is folded into a {"type": "summary"} record that replaces older turns as context.
+# Keep SUMMARY_EVERY turns (2 messages each) within MAX_HISTORY_MESSAGES so nothing is skipped.
+SUMMARY_EVERY = int(os.getenv("SUMMARY_EVERY", "8"))  # 0 disables
+SUMMARY_MODEL = os.getenv("SUMMARY_MODEL", GROQ_MODELS[0])
+SUMMARY_PROMPT = (
+    "Summarize the conversation below so it can replace the full transcript as context. "
+    "Keep facts, decisions, names and open questions. Be concise."
+)
+
+# Strong references so in-flight summaries are not garbage-collected, and can be awaited on shutdown
+_summary_tasks: Dict[str, asyncio.Task] = {}
+
+async def _summarize(slug: str, covers: str, messages: List[dict]) -> None:
+    try:
+        resp = await groq_client.chat.completions.create(
+            model=SUMMARY_MODEL,
+            messages=[{"role": "system", "content": SUMMARY_PROMPT}] + messages,
+            temperature=0.2,
+        )
+        content = resp.choices[0].message.content
+        if content:
+            await writer_enqueue(slug, {
+                "type": "summary",
+                "content": content,
+                "covers": covers,
+                "created_at": datetime.now(TZ).isoformat(timespec="seconds"),
+            })
+    except Exception as e:
+        print(f"[summary] failed for chat {slug}: {e}")
+    finally:
+        _summary_tasks.pop(slug, None)
+
+def _maybe_summarize(slug: str, covers: str, turns: int, messages: List[dict]) -> None:
+    if not (USE_GROQ and groq_client) or SUMMARY_EVERY <= 0:
+        return
+    if turns < SUMMARY_EVERY or slug in _summary_tasks:
+        return
+    _summary_tasks[slug] = asyncio.create_task(_summarize(slug, covers, messages))
 
 async def chat_once_stream(
     chat_name: str,
@@ -130,35 +501,31 @@ async def chat_once_stream(
         if not ok:
             yield "[error] cannot create chat"; return
 
+    # Make sure earlier turns still queued in the writer are on disk
+    await writer_flush(slug)
+
     # Load history (last N to control context)
-    lines = []
+    records: List[dict] = []
     try:
-        with path.open("r", encoding="utf-8") as f:
-            lines = f.readlines()
+        async with _chat_lock(slug):
+            records = _load_records(slug, path)
     except FileNotFoundError:
         pass
 
-    history: List[dict] = []
-    for ln in lines:
-        try:
-            obj = json.loads(ln)
-        except Exception:
-            continue
-        if obj.get("type") == "meta":
-            continue
-        if obj.get("role") in ("user", "assistant", "system"):
-            history.append({"role": obj["role"], "content": obj["content"]})
+    context: List[dict] = _history_messages(records)
 
+    history = context
     if system_prompt:
         history = [{"role": "system", "content": system_prompt}] + history
 
     # Append user message to file
     id = uuid.uuid4().hex[:4]
+    created_at = datetime.now(TZ).isoformat(timespec="seconds")
     # _append_jsonl(path, {
     #     "chats":{
     #         "chat_id": id,
     #         "model": model,
-    #         "created_at": datetime.now(TZ).strftime("%Y-%m-%d %H:%M:%S"),
+    #         "created_at": created_at,
     #         "time_zone": "Asia/Riyadh",
     #         "messages": [
     #         {"role": "user", "content": user_text}, 
@@ -167,25 +534,40 @@ async def chat_once_stream(
     # })
 
     # Stream assistant
-    collected: List[str] = []
+    # Collect UTF-8 bytes in one growing buffer instead of a list of small strings
+    buf = bytearray()
     model_name = model or GROQ_MODELS[0]
     async for token in _stream_from_provider(history + [{"role": "user", "content": user_text}], model_name, temperature):
-        collected.append(token)
+        buf.extend(token.encode("utf-8"))
         yield token
+    assistant_text = buf.decode("utf-8")
 
     # Persist assistant full message
-    _append_jsonl(path, {
+    await writer_enqueue(slug, {
         "chats":{
             "chat_id": id,
             "model": model_name,
-            "created_at": datetime.now(TZ).strftime("%Y-%m-%d %H:%M:%S"),
+            "created_at": created_at,
             "time_zone": "Asia/Riyadh",
             "messages": [
             {"role": "user", "content": user_text}, 
-            {"role": "assistant", "content": "".join(collected)}]
+            {"role": "assistant", "content": assistant_text}]
         }
     })
 
+    # Fold the conversation into a summary once enough turns have piled up
+    _maybe_summarize(slug, id, _turns_since_summary(records) + 1, context + [
+        {"role": "user", "content": user_text},
+        {"role": "assistant", "content": assistant_text},
+    ])
+
+
+async def sse_stream(tokens: AsyncGenerator[str, None]) -> AsyncGenerator[bytes, None]:
+    # Server-Sent Events framing: one event per token, then a final done event
+    async for token in tokens:
+        yield b"data: " + orjson.dumps({"token": token}) + b"\n\n"
+    yield b'data: {"done":true}\n\n'
+
 
 
 
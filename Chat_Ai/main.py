@@ -1,22 +1,58 @@
 # main.py
+from contextlib import asynccontextmanager
 from pathlib import Path
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Path as PathParam, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse, StreamingResponse
+from fastapi.responses import FileResponse, HTMLResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
+import asyncio
+import hashlib
 import os
 import os
 
+import orjson
+
 from chat.chat_methods import (
     create_chat,
-    provide_chat,
+    chat_file,
     chat_once_stream,
+    sse_stream,
+    writer_flush,
+    close_writers,
+    chat_index_refresher,
     list_models,
     history_chat as chats,
+    NAME_RE,
+)
+from schema.respones import (
+    CreateChatBody,
+    CreateChatResponse,
+    HistoryResponse,
+    OpenChatBody,
+    SendBody,
+    SendResponse,
 )
-from schema.respones import CreateChatBody, SendBody
 
-app = FastAPI(title="Chat_Ai API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # أعد فحص مجلد البيانات دورياً لالتقاط التغييرات الخارجية
+    index_task = asyncio.create_task(chat_index_refresher())
+    try:
+        yield
+    finally:
+        index_task.cancel()
+        # اكتب الرسائل المتبقية في الطابور قبل الإغلاق
+        await close_writers()
+
+
+app = FastAPI(title="Chat_Ai API", lifespan=lifespan)
+
+# عطّل التخزين المؤقت في البروكسي حتى تصل التوكنات فوراً
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",
+    "Connection": "keep-alive",
+}
 
 # Add CORS middleware
 app.add_middleware(
@@ -43,34 +79,49 @@ app.mount("/components", StaticFiles(directory=str(web_dir / "components")), nam
 app.mount("/app", StaticFiles(directory=str(web_dir / "app")), name="app")
 
 
+# الصفحة الرئيسية تُقرأ مرة واحدة عند التشغيل
+INDEX_HTML = (web_dir / "index.html").read_bytes()
+INDEX_ETAG = '"' + hashlib.sha1(INDEX_HTML).hexdigest()[:16] + '"'
+
+
 @app.get("/", response_class=HTMLResponse)
-async def root():
-    html_path = Path(__file__).parent / "web" / "index.html"
-    return HTMLResponse(html_path.read_text(encoding="utf-8"))
+async def root(request: Request):
+    if request.headers.get("if-none-match") == INDEX_ETAG:
+        return Response(status_code=304, headers={"ETag": INDEX_ETAG})
+    return HTMLResponse(INDEX_HTML, headers={"ETag": INDEX_ETAG})
 
 
 # توافق خلفي (كان GET /chats/create?name=...)
-@app.post("/chats/create")
-def create_chat_endpoint(body: dict):
-    ok, payload = create_chat(body.get("name"))
+@app.post("/chats/create", response_model=CreateChatResponse)
+def create_chat_endpoint(body: CreateChatBody):
+    ok, payload = create_chat(body.name, body.model)
     if not ok:
         raise HTTPException(400, payload["message"])
     return payload
 
 
-# جلب محتوى محادثة كاملة بصيغة JSONL (نص خام)
+# جلب محتوى محادثة كاملة بصيغة JSONL (الملف نفسه عبر sendfile)
 @app.post("/chats/open_chat")
-def open_chat(body: dict):
-    print(body.get("name"))
-    content = provide_chat(body.get("name"))
-    if content is None:
+async def open_chat(body: OpenChatBody):
+    path = chat_file(body.name)
+    if path is None:
         raise HTTPException(404, "Chat not found")
-    return {"name": body, "jsonl": content}
-
-
-# إرسال رسالة مع خيار البث
-@app.post("/chats/send")
-async def send(name: str, body: SendBody, stream: bool = Query(default=True)):
+    await writer_flush(path.stem)
+    return FileResponse(
+        path,
+        media_type="application/x-ndjson",
+        filename=path.name,
+        content_disposition_type="inline",
+    )
+
+
+# إرسال رسالة مع خيار البث (اسم المحادثة في المسار ويُتحقق منه في الراوتر)
+@app.post("/chats/{name}/send", response_model=SendResponse)
+async def send(
+    body: SendBody,
+    name: str = PathParam(..., pattern=f"^{NAME_RE.pattern}$"),
+    stream: bool = Query(default=True),
+):
     if stream:
         gen = chat_once_stream(
             chat_name=name,
@@ -79,7 +130,7 @@ async def send(name: str, body: SendBody, stream: bool = Query(default=True)):
             system_prompt=body.system_prompt,
             temperature=body.temperature or 0.2,
         )
-        return StreamingResponse(gen, media_type="text/plain")
+        return StreamingResponse(sse_stream(gen), media_type="text/event-stream", headers=SSE_HEADERS)
     else:
         # اجمع البث إلى نص واحد (نفس الجنريتور)
         chunks = []
@@ -94,11 +145,15 @@ async def send(name: str, body: SendBody, stream: bool = Query(default=True)):
         return {"content": "".join(chunks)}
 
 
+# قائمة النماذج ثابتة، فتُحوَّل إلى JSON مرة واحدة
+MODELS_JSON = orjson.dumps({"models": list_models()})
+
+
 @app.get("/models")
-def models():
-    return {"models": list_models()}
+async def models():
+    return Response(content=MODELS_JSON, media_type="application/json")
 
-@app.get("/history_chat")
+@app.get("/history_chat", response_model=HistoryResponse)
 def history_chat():
     list_chat = chats()
     if list_chat is None:
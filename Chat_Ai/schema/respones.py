@@ -1,13 +1,27 @@
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
 
 
 class CreateChatBody(BaseModel):
     name: str
     model: Optional[str] = None
 
+class OpenChatBody(BaseModel):
+    name: str
+
 class SendBody(BaseModel):
     content: str
     model: Optional[str] = None
     system_prompt: Optional[str] = None
-    temperature: Optional[float] = 0.2
\ No newline at end of file
+    temperature: Optional[float] = 0.2
+
+class CreateChatResponse(BaseModel):
+    id: str
+    name: str
+    created_at: str
+
+class SendResponse(BaseModel):
+    content: str
+
+class HistoryResponse(BaseModel):
+    chats: Optional[List[str]] = None
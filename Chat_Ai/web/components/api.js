@@ -126,7 +126,9 @@ class ApiClient {
                 method: 'POST',
                 body: JSON.stringify({ name })
             });
-            return this.parseJsonl(response.jsonl);
+            // The server sends the chat file itself as application/x-ndjson
+            const jsonl = typeof response === 'string' ? response : await response.text();
+            return this.parseJsonl(jsonl);
         } catch (error) {
             console.error('Error opening chat:', error);
             throw new Error(window.i18n?.t('chatNotFound') || 'Chat not found');
@@ -144,7 +146,7 @@ class ApiClient {
             attachments
         };
 
-        const url = `/chats/send?name=${encodeURIComponent(chatName)}&stream=${stream}`;
+        const url = `/chats/${encodeURIComponent(chatName)}/send?stream=${stream}`;
 
         try {
             if (stream) {
@@ -178,15 +180,32 @@ class ApiClient {
         const reader = response.body.getReader();
         const decoder = new TextDecoder();
 
+        // The server sends Server-Sent Events: `data: {"token": ...}\n\n`,
+        // closed by a final `data: {"done": true}\n\n` event.
+        // EventSource only supports GET, so the frames are parsed here.
         return {
             async *[Symbol.asyncIterator]() {
+                let buffer = '';
                 try {
                     while (true) {
                         const { done, value } = await reader.read();
                         if (done) break;
-                        
-                        const chunk = decoder.decode(value, { stream: true });
-                        yield chunk;
+
+                        buffer += decoder.decode(value, { stream: true });
+
+                        let boundary;
+                        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                            const frame = buffer.slice(0, boundary);
+                            buffer = buffer.slice(boundary + 2);
+
+                            for (const line of frame.split('\n')) {
+                                if (!line.startsWith('data:')) continue;
+
+                                const event = JSON.parse(line.slice(5).trim());
+                                if (event.done) return;
+                                if (event.token) yield event.token;
+                            }
+                        }
                     }
                 } finally {
                     reader.releaseLock();